@@ -1,7 +1,17 @@
 # recommender.py
-import psycopg2
-from typing import List, Dict, Tuple, Optional
-import math
+from psycopg2 import pool as pg_pool
+from contextlib import contextmanager
+from typing import List, Dict, Tuple, Optional, Iterable
+from itertools import chain, zip_longest
+import copy
+import threading
+import time
+import weakref
+
+import numpy as np
+
+# Rows kept per region in the in-process popularity snapshot
+POP_SNAPSHOT_DEPTH = 200
 
 def interleave_pairs(a, b, region_norm, threshold=0.2, top_n=15):
     """
@@ -10,41 +20,18 @@ def interleave_pairs(a, b, region_norm, threshold=0.2, top_n=15):
     - Alternate picks: region → global → region → global …
     - If region runs out (or all remaining fall below threshold), fill with globals.
     """
+    # One linear pass over region/global pairs. A region item below threshold keeps its
+    # slot as None, so it still uses up its turn exactly like a skipped pick.
+    a_ok = [(iid, score) if region_norm.get(iid, 0.0) >= threshold else None for iid, score in a]
     out, seen = [], set()
-    ia, ib = 0, 0
-    turn = "region"  # start with region
-
-    while len(out) < top_n and (ia < len(a) or ib < len(b)):
-        if turn == "region" and ia < len(a):
-            iid, score = a[ia]
-            ia += 1
-            if iid not in seen and region_norm.get(iid, 0.0) >= threshold:
-                out.append((iid, score, "region"))
-                seen.add(iid)
-            turn = "global"  # switch turn regardless
-
-        elif turn == "global" and ib < len(b):
-            iid, score = b[ib]
-            ib += 1
-            if iid not in seen:
-                out.append((iid, score, "global"))
-                seen.add(iid)
-            turn = "region"
-
-        else:
-            # If one side is exhausted, always take from the other
-            if ia >= len(a) or all(region_norm.get(x[0], 0.0) < threshold for x in a[ia:]):
-                # backfill with globals
-                while len(out) < top_n and ib < len(b):
-                    iid, score = b[ib]
-                    ib += 1
-                    if iid not in seen:
-                        out.append((iid, score, "global"))
-                        seen.add(iid)
-                break
-            else:
-                turn = "region"
-
+    for i, pick in enumerate(chain.from_iterable(zip_longest(a_ok, b))):
+        if len(out) >= top_n:
+            break
+        if pick is None or pick[0] in seen:
+            continue
+        iid, score = pick
+        out.append((iid, score, "global" if i & 1 else "region"))
+        seen.add(iid)
     return out
 
 
@@ -65,9 +52,13 @@ class HybridRecommender:
             score FLOAT
         )
 
+    Indexes (created by ensure_indexes()):
+      - GIN on rules.antecedent_arr (subset lookups)
+      - item_popularity (region, count DESC) INCLUDE (item_id) (top-K per region)
+
     Key ideas:
       * Cold-start: interleave region + global popular items from item_popularity.
-      * Warm-start: rules where antecedent_arr <@ basket (subset).
+      * Warm-start: rules where antecedent_arr <@ basket (subset), via a GIN index on antecedent_arr.
       * Backfill: if rules < top_n, fill with popularity (excluding basket & already picked).
       * Always map IDs -> product names using product_map.
     """
@@ -81,6 +72,9 @@ class HybridRecommender:
         product_map_table: str = "product_map",
         antecedent_col: str = "antecedent_arr",
         consequent_col: str = "consequent_arr",
+        min_conn: Optional[int] = None,
+        max_conn: int = 8,
+        pop_cache_ttl: float = 300.0,
     ):
         self.conn_params = conn_params
         self.region = region
@@ -89,24 +83,128 @@ class HybridRecommender:
         self.product_map_table = product_map_table
         self.antecedent_col = antecedent_col
         self.consequent_col = consequent_col
+        self.pop_cache_ttl = pop_cache_ttl
+        self._alpha_c = 3.0  # see _adaptive_alpha
 
         self.basket: set[int] = set()
         self.id_to_item: Dict[int, str] = {}
+        # region -> (monotonic fetch time, LIMIT used, item_ids, counts) sorted by count DESC
+        self._pop_cache: Dict[str, Tuple[float, int, np.ndarray, np.ndarray]] = {}
+        # Bitset over the item-id domain, True for ids in the basket (synced lazily, see _sync_basket_mask)
+        self._basket_mask = np.zeros(1, dtype=bool)
+        self._mask_ids: frozenset = frozenset()
+        # (region, top_n) -> (snapshot fetch times it was built from, cold-start results)
+        self._cold_cache: Dict[Tuple[str, int], Tuple[Tuple[float, ...], List[Dict]]] = {}
+        # Long-lived connections, reused across recommend() calls. min_conn defaults to
+        # max_conn: psycopg2's putconn() closes any connection returned while min_conn are
+        # already idle, so a smaller floor means connect + PREPARE again on every call
+        # whenever several sessions (forks) are busy at once.
+        if min_conn is None:
+            min_conn = max_conn
+        self._pool = pg_pool.ThreadedConnectionPool(min_conn, max_conn, **conn_params)
+        # getconn() raises PoolError instead of waiting when all max_conn are out;
+        # this makes callers (e.g. every Streamlit session sharing one fork()ed pool) queue
+        self._pool_slots = threading.BoundedSemaphore(max_conn)
+        # Pooled connections that already hold our PREPAREd statements
+        self._prepared = weakref.WeakSet()
         self._load_product_map()
 
     # ---------------------------
     # Setup / utilities
     # ---------------------------
-    def _connect(self):
-        return psycopg2.connect(**self.conn_params)
+    @contextmanager
+    def _connection(self):
+        """Borrow an autocommit connection from the pool (waiting for a free one); always hand it back."""
+        with self._pool_slots:
+            conn = self._pool.getconn()
+            try:
+                if not conn.autocommit:
+                    conn.autocommit = True
+                yield conn
+            finally:
+                self._pool.putconn(conn)
+
+    def _prepare(self, conn):
+        """PREPARE the per-request query once per connection so Postgres plans it once.
+        Done lazily by _fetch_rules, so a broken rules table only breaks the warm path."""
+        if conn in self._prepared:
+            return
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                PREPARE reco_rules (int[], int) AS
+                WITH rl AS (
+                    SELECT {self.consequent_col} AS cons, score
+                    FROM {self.rule_table}
+                    WHERE {self.antecedent_col} <@ $1
+                    ORDER BY score DESC
+                    LIMIT $2
+                )
+                SELECT cons[1] AS item_id, MAX(score) AS score  -- single-item consequent
+                FROM rl
+                WHERE NOT (cons && $1)  -- skip if consequent overlaps basket
+                GROUP BY 1
+                ORDER BY 2 DESC
+            """)
+        self._prepared.add(conn)
+
+    def close(self):
+        """Close every pooled connection (forks share the pool, so this closes theirs too)."""
+        self._pool.closeall()
+
+    def fork(self, region: Optional[str] = None) -> "HybridRecommender":
+        """
+        Another recommender over the same data with its own basket and region.
+        Shares the pool, product map and popularity / cold-start caches, so it costs
+        nothing to create; use one fork per user session.
+        """
+        other = copy.copy(self)
+        other.region = self.region if region is None else region
+        other.basket = set()
+        other._basket_mask = np.zeros(self._basket_mask.size, dtype=bool)
+        other._mask_ids = frozenset()
+        return other
+
+    def ensure_indexes(self):
+        """One-time DDL: indexes the hot queries rely on (safe to re-run)."""
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.rule_table}_{self.antecedent_col}_gin "
+                f"ON {self.rule_table} USING GIN ({self.antecedent_col})"
+            )
+            # Covers `WHERE region = .. ORDER BY count DESC LIMIT k` as an index-only scan
+            cur.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.popularity_table}_region_count "
+                f"ON {self.popularity_table} (region, count DESC) INCLUDE (item_id)"
+            )
 
     def _load_product_map(self):
         """Load id->description into memory once (fast lookup)."""
-        conn = self._connect()
-        cur = conn.cursor()
-        cur.execute(f"SELECT item_id, description FROM {self.product_map_table}")
-        self.id_to_item = {row[0]: row[1] for row in cur.fetchall()}
-        cur.close(); conn.close()
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute(f"SELECT item_id, description FROM {self.product_map_table}")
+            self.id_to_item = {row[0]: row[1] for row in cur.fetchall()}
+        self._grow_mask(max(self.id_to_item, default=-1))
+
+    def _grow_mask(self, max_id: int):
+        """Make _basket_mask long enough to index item_id `max_id`."""
+        if max_id >= self._basket_mask.size:
+            grown = np.zeros(max_id + 1, dtype=bool)
+            grown[:self._basket_mask.size] = self._basket_mask
+            self._basket_mask = grown
+
+    def _sync_basket_mask(self):
+        """Flip _basket_mask bits to match self.basket (callers may mutate the set directly)."""
+        if self._mask_ids == self.basket:
+            return
+        ids = frozenset(self.basket)
+        self._grow_mask(max(ids, default=-1))
+        self._basket_mask[list(self._mask_ids - ids)] = False
+        self._basket_mask[list(ids - self._mask_ids)] = True
+        self._mask_ids = ids
+
+    def _describe(self, item_ids: List[int]) -> List[str]:
+        """Product names for the final picks, in order."""
+        names = self.id_to_item
+        return [names[iid] if iid in names else f"<unknown:{iid}>" for iid in item_ids]
 
     def set_region(self, region: str):
         self.region = region
@@ -131,49 +229,105 @@ class HybridRecommender:
         top_n_region: int = 20,
         top_n_global: int = 20,
         exclude_ids: Optional[List[int]] = None,
-    ) -> List[Tuple[int, int, str]]:
+        basket: Optional[set] = None,
+    ) -> Tuple[Tuple[np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray]]:
         """
-        Return interleaved popularity list: [(item_id, count, 'region'|'global'), ...]
-        Excludes any IDs in exclude_ids (e.g. basket or already-picked).
+        Return ((region_ids, region_counts), (global_ids, global_counts)), int64 arrays by count DESC.
+        Never returns basket items (self.basket unless `basket` is given); also excludes
+        any IDs in exclude_ids (e.g. already-picked).
+        Served from the cached per-region snapshots; exclusions are one bitset gather per snapshot.
         """
-        exclude_ids = exclude_ids or []
-        conn = self._connect()
-        cur = conn.cursor()
-
-        # Region-specific (skip basket/already-picked in SQL)
-        cur.execute(
-            f"""
-            SELECT item_id, count
-            FROM {self.popularity_table}
-            WHERE region = %s
-              AND NOT (item_id = ANY(%s))  -- exclude
-            ORDER BY count DESC
-            LIMIT %s
-            """,
-            (self.region, exclude_ids, top_n_region * 2),  # fetch extra in case of exclusions
-        )
-        region_rows = cur.fetchall()
-
-        # Global
-        cur.execute(
-            f"""
-            SELECT item_id, count
-            FROM {self.popularity_table}
-            WHERE region = 'GLOBAL'
-              AND NOT (item_id = ANY(%s))
-            ORDER BY count DESC
-            LIMIT %s
-            """,
-            (exclude_ids, top_n_global * 2),
-        )
-        global_rows = cur.fetchall()
+        if basket is None:
+            self._sync_basket_mask()
+            excluded = self._basket_mask
+            n_excluded = len(self._mask_ids)
+        else:
+            self._grow_mask(max(basket, default=-1))
+            excluded = np.zeros_like(self._basket_mask)
+            excluded[list(basket)] = True
+            n_excluded = len(basket)
+        if exclude_ids:
+            self._grow_mask(max(exclude_ids))
+            grown = np.zeros_like(self._basket_mask)
+            grown[:excluded.size] = excluded
+            excluded = grown
+            excluded[list(exclude_ids)] = True
+            n_excluded += len(exclude_ids)
+        snapshots = self._popularity_snapshots([self.region, "GLOBAL"])
 
-        cur.close(); conn.close()
+        def first_allowed(ids, limit):
+            # ids past the end of the mask were never excluded
+            inside = ids < excluded.size
+            allowed = ~(inside & excluded[np.where(inside, ids, 0)])
+            return np.flatnonzero(allowed)[:limit]
 
-        # Tag but do NOT interleave here — just return raw rows
-        region_tagged = [(iid, score, "region") for iid, score in region_rows]
-        global_tagged = [(iid, score, "global") for iid, score in global_rows]
-        return region_tagged + global_tagged
+        def pick(region, limit):
+            ids, counts = snapshots[region]
+            keep = first_allowed(ids, limit)
+            if keep.size < limit and self._pop_cache[region][1] <= ids.size:
+                # Snapshot truncated and too shallow once exclusions are removed:
+                # limit + |exclude| rows always suffice, so deepen it once and refilter
+                ids, counts = self._popularity_snapshots([region], depth=limit + n_excluded)[region]
+                keep = first_allowed(ids, limit)
+            return ids[keep], counts[keep]
+
+        # Fetch extra in case of exclusions; do NOT interleave here — just return raw rows
+        return pick(self.region, top_n_region * 2), pick("GLOBAL", top_n_global * 2)
+
+    def _popularity_snapshots(
+        self, regions: Iterable[str], depth: int = POP_SNAPSHOT_DEPTH
+    ) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Top (item_ids, counts) per region (at least `depth` rows, if the region has that many),
+        cached for pop_cache_ttl seconds. Regions that are missing, expired or too shallow are
+        refreshed together in one plain `WHERE region = .. ORDER BY count DESC LIMIT ..` query.
+        """
+        regions = list(dict.fromkeys(regions))
+        depth = max(depth, POP_SNAPSHOT_DEPTH)
+        now = time.monotonic()
+        stale = []
+        for r in regions:
+            entry = self._pop_cache.get(r)
+            if (
+                entry is None
+                or now - entry[0] > self.pop_cache_ttl
+                or (entry[1] < depth and entry[2].size >= entry[1])  # truncated, and too shallow
+            ):
+                stale.append(r)
+        if stale:
+            query = " UNION ALL ".join(
+                f"""(SELECT %s, item_id, count
+                     FROM {self.popularity_table}
+                     WHERE region = %s
+                     ORDER BY count DESC
+                     LIMIT %s)"""
+                for _ in stale
+            )
+            params = [p for r in stale for p in (r, r, depth)]
+            with self._connection() as conn, conn.cursor() as cur:
+                cur.execute(query, params)
+                fetched = cur.fetchall()
+
+            fresh = {r: [] for r in stale}
+            for region, iid, cnt in fetched:
+                fresh[region].append((iid, cnt))
+            for r in stale:
+                rows = np.array(fresh[r], dtype=np.int64).reshape(-1, 2)
+                ids, counts = rows[:, 0].copy(), rows[:, 1].copy()
+                self._pop_cache[r] = (now, depth, ids, counts)
+
+        return {r: self._pop_cache[r][2:] for r in regions}
+
+    def _snapshot_stamp(self, regions: Iterable[str]) -> Optional[Tuple[float, ...]]:
+        """Fetch times of the cached snapshots for `regions`; None if any is missing or expired."""
+        now = time.monotonic()
+        stamp = []
+        for r in regions:
+            entry = self._pop_cache.get(r)
+            if entry is None or now - entry[0] > self.pop_cache_ttl:
+                return None
+            stamp.append(entry[0])
+        return tuple(stamp)
 
 
     # ---------------------------
@@ -181,36 +335,66 @@ class HybridRecommender:
     # ---------------------------   
 
     def _fetch_rules(self, basket_ids, fetch_limit=100):
+        """
+        Fetch candidate consequents based on association rules (antecedent_arr/consequent_arr are INT[]).
+        Aggregation happens in Postgres (prepared statement `reco_rules`, see _prepare):
+        one row per consequent with its best score, consequents overlapping the basket
+        dropped, ordered by score DESC. The `<@` containment test is served by the GIN
+        index from ensure_indexes().
+        """
         if not basket_ids:
-                return {}
-            
-        """Fetch candidate consequents based on association rules (antecedent_key/consequent_key are TEXT)."""
-        conn = psycopg2.connect(**self.conn_params)
-        cur = conn.cursor()
-    
-        # Convert basket IDs into text array for Postgres
-        basket_strs = [str(b) for b in basket_ids]
-    
-        cur.execute("""
-            SELECT consequent_key, confidence, lift, score
-            FROM rules
-            WHERE string_to_array(antecedent_key, ',') <@ %s::text[]
-            ORDER BY score DESC
-            LIMIT %s
-        """, (basket_strs, fetch_limit))
-    
-        rows = cur.fetchall()
-        cur.close(); conn.close()
-    
-        basket_set = set(basket_ids)
-        recs = {}
-        for cons_str, conf, lift, score in rows:
-            cons_items = set(map(int, cons_str.split(",")))  # split text "96" → {96}
-            # skip if consequent overlaps basket
-            if cons_items & basket_set:
-                continue
-            c = list(cons_items)[0]   # single-item consequent
-            recs[c] = max(recs.get(c, 0), score)
+            return {}
+
+        with self._connection() as conn:
+            self._prepare(conn)
+            with conn.cursor() as cur:
+                cur.execute(
+                    "EXECUTE reco_rules (%s::int[], %s)",
+                    ([int(b) for b in basket_ids], fetch_limit),
+                )
+                return dict(cur.fetchall())
+
+
+    def _fetch_rules_batch(self, baskets: List[set], fetch_limit=100) -> Dict[int, Dict[int, float]]:
+        """
+        _fetch_rules for many baskets in one query: {basket index: {item_id: best score}}.
+        Baskets are shipped as parallel (basket index, item) arrays, re-grouped with
+        array_agg, and each one gets its own top-`fetch_limit` rules via LATERAL.
+        """
+        user_idx = [u for u, b in enumerate(baskets) for _ in b]
+        items = [i for b in baskets for i in b]
+        if not items:
+            return {}
+
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute(f"""
+                WITH b AS (
+                    SELECT user_idx, array_agg(item) AS basket
+                    FROM unnest(%(users)s::int[], %(items)s::int[]) AS v(user_idx, item)
+                    GROUP BY user_idx
+                ),
+                rl AS (
+                    SELECT b.user_idx, b.basket, r.cons, r.score
+                    FROM b
+                    CROSS JOIN LATERAL (
+                        SELECT {self.consequent_col} AS cons, score
+                        FROM {self.rule_table}
+                        WHERE {self.antecedent_col} <@ b.basket
+                        ORDER BY score DESC
+                        LIMIT %(limit)s
+                    ) r
+                )
+                SELECT user_idx, cons[1] AS item_id, MAX(score) AS score  -- single-item consequent
+                FROM rl
+                WHERE NOT (cons && basket)  -- skip if consequent overlaps basket
+                GROUP BY 1, 2
+                ORDER BY 1, 3 DESC
+            """, {"users": user_idx, "items": items, "limit": fetch_limit})
+            rows = cur.fetchall()
+
+        recs: Dict[int, Dict[int, float]] = {}
+        for u, iid, score in rows:
+            recs.setdefault(u, {})[iid] = score
         return recs
 
 
@@ -230,12 +414,14 @@ class HybridRecommender:
         """Min-max normalize rule scores into [0,1]."""
         if not rules_dict:
             return {}
-        vals = list(rules_dict.values())
-        mn, mx = min(vals), max(vals)
+        vals = np.fromiter(rules_dict.values(), dtype=np.float64, count=len(rules_dict))
+        mn, mx = vals.min(), vals.max()
         if mx == mn:
             # single non-zero value => set to 1.0, zeros stay 0.0
-            return {iid: (1.0 if v > 0 else 0.0) for iid, v in rules_dict.items()}
-        return {iid: (v - mn) / (mx - mn) for iid, v in rules_dict.items()}
+            norm = np.where(vals > 0, 1.0, 0.0)
+        else:
+            norm = (vals - mn) / (mx - mn)
+        return dict(zip(rules_dict.keys(), norm.tolist()))
     
     def _normalize_pop_scores(self, pop_scores: Dict[int, float]) -> Dict[int, float]:
         """
@@ -244,16 +430,14 @@ class HybridRecommender:
         """
         if not pop_scores:
             return {}
-        ids, vals = zip(*pop_scores.items())
-        vals_log = [math.log1p(v) for v in vals]
-        mn, mx = min(vals_log), max(vals_log)
+        vals = np.fromiter(pop_scores.values(), dtype=np.float64, count=len(pop_scores))
+        y = np.log1p(vals)
+        mn, mx = y.min(), y.max()
         if mx == mn:
-            return {iid: (1.0 if v > 0 else 0.0) for iid, v in pop_scores.items()}
-        normalized = {}
-        for iid, v in pop_scores.items():
-            y = math.log1p(v)
-            normalized[iid] = (y - mn) / (mx - mn)
-        return normalized
+            norm = np.where(vals > 0, 1.0, 0.0)
+        else:
+            norm = (y - mn) / (mx - mn)
+        return dict(zip(pop_scores.keys(), norm.tolist()))
 
     # ---------------------------
     # 3) Main recommend()
@@ -264,113 +448,157 @@ class HybridRecommender:
           - Cold start: region_score or global_score (normalized separately)
           - Warm start: final_score + rule_norm/pop_norm (normalized on union)
         """
-        exclude = list(self.basket)  # never recommend items already in basket
-    
         # -------------------------
         # Case A: Cold start
         # -------------------------
         if not self.basket:
-            # fetch region + global popularity
-            pop_all = self._fetch_popularity(
-                top_n_region=top_n,
-                top_n_global=top_n,
-                exclude_ids=exclude
-            )
-        
-            # Separate sets
-            pop_region = [(iid, score) for (iid, score, src) in pop_all if src == "region"]
-            pop_global = [(iid, score) for (iid, score, src) in pop_all if src == "global"]
-        
-            # Normalization per set
-            def minmax_norm(vals):
-                if not vals:
-                    return {}
-                min_v, max_v = min(v for _, v in vals), max(v for _, v in vals)
-                if max_v == min_v:
-                    return {iid: 1.0 for iid, _ in vals}
-                return {iid: (v - min_v) / (max_v - min_v) for iid, v in vals}
-        
-            region_norm = minmax_norm(pop_region)
-            global_norm = minmax_norm(pop_global)
-        
-            # Threshold-aware interleaving
-            pop = interleave_pairs(pop_region, pop_global, region_norm, threshold=0.2, top_n=top_n)
-    
-        
-            results = []
-            for (iid, score, src) in pop[:top_n]:
-                results.append({
-                    "item_id": iid,
-                    "description": self.id_to_item.get(iid, f"<unknown:{iid}>"),
-                    "region_score": region_norm.get(iid) if src == "region" else None,
-                    "global_score": global_norm.get(iid) if src == "global" else None,
-                    "source": src
-                })
-            return results
+            return self._recommend_cold(top_n)
 
-    
         # -------------------------
         # Case B: Warm start
         # -------------------------
+        # Already deduplicated, basket-free and ranked by score in SQL
         rules_dict = self._fetch_rules(list(self.basket), fetch_limit=top_n * 8)
-        ranked_rules = sorted(rules_dict.items(), key=lambda x: x[1], reverse=True)
-    
-        picked_ids, results = set(), []
-        candidate_scores = {}
-    
-        # Collect rules scores
-        for iid, score in ranked_rules:
-            if iid not in self.basket:
-                candidate_scores[iid] = {"rule": score}
+        return self._rank_warm(rules_dict, top_n)
+
+    def recommend_batch(self, baskets: List[set], top_n: int = 15) -> Dict[int, List[Dict]]:
+        """
+        recommend() for many baskets at once: {basket index: results}.
+        All warm baskets share one rules round-trip (see _fetch_rules_batch);
+        empty baskets get the (shared) cold-start list.
+        """
+        baskets = [{int(i) for i in b} for b in baskets]
+        rules_by_user = self._fetch_rules_batch(baskets, fetch_limit=top_n * 8)
+
+        results = {}
+        for idx, basket in enumerate(baskets):
+            if not basket:
+                results[idx] = self._recommend_cold(top_n)  # memoized after the first
+            else:
+                results[idx] = self._rank_warm(rules_by_user.get(idx, {}), top_n, basket=basket)
+        return results
+
+    def _recommend_cold(self, top_n: int) -> List[Dict]:
+        """
+        Cold start: threshold-aware interleave of region + global popularity.
+        Depends only on (region, top_n) and the popularity snapshots, so it is memoized
+        until either snapshot is refreshed.
+        """
+        key = (self.region, top_n)
+        hit = self._cold_cache.get(key)
+        if hit is not None and hit[0] == self._snapshot_stamp([self.region, "GLOBAL"]):
+            return [dict(r) for r in hit[1]]
+
+        # fetch region + global popularity; the basket is empty by definition here,
+        # so never read self.basket (recommend_batch calls this for any instance)
+        region, glob = self._fetch_popularity(
+            top_n_region=top_n,
+            top_n_global=top_n,
+            basket=set(),
+        )
+        
+        # Normalization per set
+        def minmax_norm(ids, counts):
+            if not ids.size:
+                return {}
+            v = counts.astype(np.float64)
+            min_v, max_v = v.min(), v.max()
+            if max_v == min_v:
+                return dict.fromkeys(ids.tolist(), 1.0)
+            return dict(zip(ids.tolist(), ((v - min_v) / (max_v - min_v)).tolist()))
+        
+        region_norm = minmax_norm(*region)
+        global_norm = minmax_norm(*glob)
+        
+        # Threshold-aware interleaving
+        pop_region = list(zip(region[0].tolist(), region[1].tolist()))
+        pop_global = list(zip(glob[0].tolist(), glob[1].tolist()))
+        pop = interleave_pairs(pop_region, pop_global, region_norm, threshold=0.2, top_n=top_n)
     
-        # Collect popularity scores for backfill
-        exclude_more = list(self.basket.union(set(candidate_scores.keys())))
-        pop = self._fetch_popularity(
+        
+        pop = pop[:top_n]
+        descriptions = self._describe([iid for iid, _, _ in pop])
+        results = [
+            {
+                "item_id": iid,
+                "description": desc,
+                "region_score": region_norm.get(iid) if src == "region" else None,
+                "global_score": global_norm.get(iid) if src == "global" else None,
+                "source": src
+            }
+            for (iid, score, src), desc in zip(pop, descriptions)
+        ]
+        self._cold_cache[key] = (self._snapshot_stamp([self.region, "GLOBAL"]), results)
+        return [dict(r) for r in results]
+
+    def _rank_warm(self, rules_dict: Dict[int, float], top_n: int, basket: Optional[set] = None) -> List[Dict]:
+        """
+        Warm start: blend rule hits with popularity backfill for `basket` (default self.basket).
+        rules_dict is {item_id: score} as returned by _fetch_rules.
+        """
+        basket_size = len(self.basket if basket is None else basket)
+
+        # Collect popularity scores for backfill (cached; no DB round-trip when warm)
+        (r_ids, r_counts), (g_ids, g_counts) = self._fetch_popularity(
             top_n_region=top_n,
             top_n_global=top_n,
-            exclude_ids=exclude_more
+            exclude_ids=list(rules_dict),  # basket is always excluded
+            basket=basket,
         )
-        for iid, score, src in pop:
-            if iid not in self.basket:
-                if iid not in candidate_scores:
-                    candidate_scores[iid] = {}
-                candidate_scores[iid]["pop"] = score
+        pop_scores = dict(zip(  # global count wins on overlap
+            np.concatenate([r_ids, g_ids]).tolist(),
+            np.concatenate([r_counts, g_counts]).tolist(),
+        ))
     
         # -------------------------
-        # Normalization (on union set)
+        # Candidates as parallel arrays: rule hits first, then popularity.
+        # The two are disjoint (rule hits are excluded from the backfill).
         # -------------------------
-        def minmax_dict(d: Dict[int, float]):
-            if not d: return {}
-            vals = list(d.values())
-            min_v, max_v = min(vals), max(vals)
-            return {k: (v - min_v) / (max_v - min_v + 1e-9) for k, v in d.items()}
+        n_rule, n_pop = len(rules_dict), len(pop_scores)
+        ids = np.fromiter(chain(rules_dict, pop_scores), dtype=np.int64, count=n_rule + n_pop)
+        rule_vals = np.fromiter(rules_dict.values(), dtype=np.float64, count=n_rule)
+        pop_vals = np.fromiter(pop_scores.values(), dtype=np.float64, count=n_pop)
     
-        rule_scores = {iid: s["rule"] for iid, s in candidate_scores.items() if "rule" in s}
-        pop_scores = {iid: s["pop"] for iid, s in candidate_scores.items() if "pop" in s}
+        # -------------------------
+        # Normalization (per source); NaN = no score from that source
+        # -------------------------
+        def minmax(vals: np.ndarray) -> np.ndarray:
+            if not vals.size: return vals
+            min_v, max_v = vals.min(), vals.max()
+            return (vals - min_v) / (max_v - min_v + 1e-9)
     
-        rule_norm = minmax_dict(rule_scores)
-        pop_norm = minmax_dict(pop_scores)
+        rule_norm = np.full(ids.size, np.nan)
+        rule_norm[:n_rule] = minmax(rule_vals)
+        pop_norm = np.full(ids.size, np.nan)
+        pop_norm[n_rule:] = minmax(pop_vals)
     
-        # Adaptive alpha
-        c=3
-        alpha = min(1.0, max(0.0, len(self.basket) / (len(self.basket)+c)))
-
+        # Adaptive alpha (basket_size >= 1, so already in (0, 1))
+        alpha = self._adaptive_alpha(basket_size, self._alpha_c)
     
         # Final scoring
-        for iid, comp in candidate_scores.items():
-            rn = rule_norm.get(iid, 0.0)
-            pn = pop_norm.get(iid, 0.0)
-            final_score = alpha * rn + (1 - alpha) * pn
+        final = alpha * np.nan_to_num(rule_norm) + (1 - alpha) * np.nan_to_num(pop_norm)
+
+        # Stable sort, so tied scores keep candidate order (a partial argpartition would pick
+        # an arbitrary subset of the items tied at the cut); candidates number in the hundreds
+        order = np.argsort(-final, kind="stable")[:top_n]
     
-            results.append({
+        # Gather the winners' columns once; descriptions resolved only for them
+        win_ids = ids[order].tolist()
+        return [
+            {
                 "item_id": iid,
-                "description": self.id_to_item.get(iid, f"<unknown:{iid}>"),
-                "final_score": final_score,
-                "rule_norm": rn if "rule" in comp else None,
-                "pop_norm": pn if "pop" in comp else None,
-                "source": "rules" if "rule" in comp else "popularity"
-            })
-    
-        # Sort by final_score
-        results = sorted(results, key=lambda x: x["final_score"], reverse=True)
-        return results[:top_n]
+                "description": desc,
+                "final_score": fs,
+                "rule_norm": rn if is_rule else None,
+                "pop_norm": None if is_rule else pn,
+                "source": "rules" if is_rule else "popularity"
+            }
+            for iid, desc, fs, rn, pn, is_rule in zip(
+                win_ids,
+                self._describe(win_ids),
+                final[order].tolist(),
+                rule_norm[order].tolist(),
+                pop_norm[order].tolist(),
+                (order < n_rule).tolist(),
+            )
+        ]
@@ -2,10 +2,11 @@
 import os
 import re
 import time
+import bisect
 import html
+from typing import List, Tuple
 import streamlit as st
-import pandas as pd
-import psycopg2
+import numpy as np
 from recommender import HybridRecommender
 
 st.set_page_config(page_title="Hybrid Recommender Demo", layout="wide")
@@ -33,6 +34,16 @@ def get_conn_params():
     }
 
 
+@st.cache_data(ttl=3600)
+def _load_regions(params_tuple):
+    """Distinct regions with popularity data; the set only changes on the scale of days.
+    Borrows a connection from the shared recommender's pool (see _get_reco)."""
+    with _get_reco(params_tuple)._connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT DISTINCT region FROM item_popularity ORDER BY region;")
+        rows = cur.fetchall()
+    return [r[0] for r in rows if r[0] is not None]
+
+
 # ---------------------------
 # Helpers
 # ---------------------------
@@ -44,28 +55,47 @@ def safe_rerun():
 
 
 def highlight_match(text: str, query: str, highlight_bg: str = "#007acc", highlight_fg: str = "#ffffff") -> str:
+    """HTML-escape text, wrapping each case-insensitive occurrence of query in a highlight span."""
     if not query:
         return html.escape(text)
-    try:
-        q = re.escape(query)
-        pattern = re.compile(q, re.IGNORECASE)
-        def _repl(m):
-            s = m.group(0)
-            return f"<span style='background:{highlight_bg}; color:{highlight_fg}; padding:2px 4px; border-radius:4px;'>{html.escape(s)}</span>"
-        res = pattern.sub(_repl, text)
-        return res
-    except Exception:
+    t_low = text.lower()
+    q_low = query.lower()
+    if len(t_low) != len(text):
+        # lowercasing changed the length (e.g. 'İ'), so offsets into t_low don't map back
         return html.escape(text)
+    n = len(q_low)
+    out = []
+    i = 0
+    while True:
+        j = t_low.find(q_low, i)
+        if j < 0:
+            out.append(html.escape(text[i:]))
+            break
+        out.append(html.escape(text[i:j]))
+        out.append(f"<span style='background:{highlight_bg}; color:{highlight_fg}; padding:2px 4px; border-radius:4px;'>{html.escape(text[j:j + n])}</span>")
+        i = j + n
+    return "".join(out)
 
 
 # ---------------------------
 # Initialize recommender & state
 # ---------------------------
+@st.cache_resource
+def _get_reco(params_tuple):
+    """Process-wide recommender: the product map and pool load once, and a cold-start
+    pass warms the GLOBAL popularity snapshot. Sessions work on their own fork().
+    Indexes are a one-time setup step (see README), not created from the web process."""
+    base = HybridRecommender(conn_params=dict(params_tuple), region="GLOBAL")
+    base.recommend()
+    return base
+
+
 if "reco_obj" not in st.session_state:
-    conn = get_conn_params()
-    st.session_state.reco_obj = HybridRecommender(conn_params=conn, region="GLOBAL")
+    st.session_state.reco_obj = _get_reco(tuple(sorted(get_conn_params().items()))).fork()
     st.session_state.region_selected = False
-    st.session_state.basket = set()
+    st.session_state.basket = frozenset()  # replaced, never mutated, so it can key caches as-is
+    st.session_state.basket_version = 0  # bumped by every basket edit; reco.basket is re-synced when it moves
+    st.session_state.synced_basket_version = 0
 
 reco: HybridRecommender = st.session_state.reco_obj
 
@@ -80,13 +110,7 @@ if not st.session_state.region_selected:
     st.subheader("Step 1 — Select your region")
 
     try:
-        conn_params = get_conn_params()
-        conn = psycopg2.connect(**conn_params)
-        cur = conn.cursor()
-        cur.execute("SELECT DISTINCT region FROM item_popularity ORDER BY region;")
-        rows = cur.fetchall()
-        cur.close(); conn.close()
-        regions = [r[0] for r in rows if r[0] is not None]
+        regions = list(_load_regions(tuple(sorted(get_conn_params().items()))))
     except Exception as e:
         st.warning(f"Could not load regions from DB; falling back to GLOBAL. (Error: {e})")
         regions = []
@@ -123,28 +147,96 @@ background: linear-gradient(180deg, #0f1724, #10243a);
 color: #ffffff;
 """
 DESCRIPTION_STYLE = "color:#ffffff; font-size:14px; line-height:1.35;"
+CARD_TMPL = f"""
+            <div style="{CARD_STYLE}">
+              <div style="display:flex; justify-content:space-between; align-items:center;">
+                <div style="flex:1; padding-right:12px;">
+                  <h4 style="margin:0 0 6px 0; color:#ffffff;">{{desc}}</h4>
+                  <div style="color:#d0d7e0; margin-bottom:6px;">Item ID: <b style="color:#ffffff;">{{iid}}</b> — <i>{{reason}}</i></div>
+                  <div style="{DESCRIPTION_STYLE}">Source: <b>{{src}}</b></div>
+                </div>
+                <div style="text-align:right; min-width:140px;">
+                  <div style="color:#a7e3ff; font-weight:700; font-size:16px;">Score: {{score:.3f}}</div>
+                </div>
+              </div>
+            </div>
+            """
+# why a recommendation was made, by result source
+REASON = {
+    "region": "Popular in selected region",
+    "global": "Popular globally",
+    "rules": "Association-rule based: users who bought items in your basket also bought this",
+    "popularity": "Popularity-based",
+}
 
 
 # ---------------------------
 # Search callback: update matches on every keystroke
 # ---------------------------
+SEARCH_LIMIT = 100  # matches kept per query
+_NON_DIGIT_RE = re.compile(r"\D")
+
+
+@st.cache_resource(max_entries=32)
+def _get_catalog_arrays(_reco: HybridRecommender, catalog_key):
+    """Catalog as parallel arrays (ids, descriptions) plus searchable buffers, built once per product map.
+
+    Lowercased descriptions and the id strings are each joined into one NUL-separated buffer
+    with row start offsets, so a search is a C-level find over the buffer instead of a per-row
+    scan. Postgres text can't contain NUL, so the separator never appears inside a row.
+    """
+    ids = np.fromiter(_reco.id_to_item.keys(), dtype=np.int64, count=len(_reco.id_to_item))
+    descs = np.array(list(_reco.id_to_item.values()), dtype=object)
+    desc_buf, desc_offs = _join_rows([d.lower() if isinstance(d, str) else "" for d in descs])
+    id_buf, id_offs = _join_rows([str(i) for i in ids.tolist()])
+    return ids, descs, (desc_buf, desc_offs), (id_buf, id_offs)
+
+
+def _join_rows(rows: List[str]) -> Tuple[str, List[int]]:
+    offs = [0]
+    for r in rows:
+        offs.append(offs[-1] + len(r) + 1)
+    return "\x00".join(rows), offs
+
+
+def _find_rows(buf: str, offs: List[int], needle: str, limit: int) -> List[int]:
+    """Indices of the first `limit` rows whose text contains needle, in catalog order."""
+    rows = []
+    if "\x00" in needle:
+        return rows
+    find = buf.find
+    pos = 0
+    while len(rows) < limit:
+        p = find(needle, pos)
+        if p < 0:
+            break
+        r = bisect.bisect_right(offs, p) - 1
+        rows.append(r)
+        pos = offs[r + 1]  # one hit per row is enough; resume at the next row
+    return rows
+
+
 def update_search_matches():
     q = st.session_state.get("search_input", "") or ""
     q_str = str(q).strip()
-    df = pd.DataFrame(list(reco.id_to_item.items()), columns=["item_id", "description"])
+    # whitespace-only edits leave the effective query unchanged; keep the previous matches
+    if q_str == st.session_state.get("_last_search_q") and "search_matches" in st.session_state:
+        return
+    st.session_state._last_search_q = q_str
     if q_str == "":
         st.session_state.search_matches = []
         return
-    mask_desc = df["description"].str.contains(q_str, case=False, na=False)
-    digit_part = "".join([c for c in q_str if c.isdigit()])
-    mask_id = pd.Series([False] * len(df))
-    if q_str.isdigit():
-        mask_id = df["item_id"].astype(str).str.contains(q_str)
-    elif digit_part:
-        mask_id = df["item_id"].astype(str).str.contains(digit_part)
-    final_mask = mask_desc | mask_id
-    matches_df = df[final_mask].head(100)
-    st.session_state.search_matches = matches_df.to_dict("records")
+    ids_np, descs, desc_index, id_index = _get_catalog_arrays(reco, (id(reco.id_to_item), len(reco.id_to_item)))
+    # literal substring match; the query is user text, not a pattern.
+    # Both scans stop after SEARCH_LIMIT hits: the first SEARCH_LIMIT rows of the union
+    # are always among the first SEARCH_LIMIT rows of each side.
+    rows = _find_rows(*desc_index, q_str.lower(), SEARCH_LIMIT)
+    digit_part = _NON_DIGIT_RE.sub("", q_str)
+    # a purely numeric query is its own digit part
+    if digit_part:
+        rows = sorted(set(rows).union(_find_rows(*id_index, digit_part, SEARCH_LIMIT)))
+    idx = np.asarray(rows[:SEARCH_LIMIT], dtype=np.intp)
+    st.session_state.search_matches = list(zip(ids_np[idx].tolist(), descs[idx].tolist()))
 
 
 # ---------------------------
@@ -153,11 +245,12 @@ def update_search_matches():
 with st.sidebar:
     st.header("Your Basket")
     if st.session_state.basket:
-        for i, iid in enumerate(sorted(list(st.session_state.basket))):
+        for iid in sorted(st.session_state.basket):
             st.markdown(f"**{iid}** — {reco.id_to_item.get(iid, '<unknown>')}")
             # remove button using session state
-            if st.button("Remove", key=f"remove_{iid}_{i}"):
-                st.session_state.basket.discard(iid)
+            if st.button("Remove", key=f"remove_{iid}"):
+                st.session_state.basket = st.session_state.basket - {iid}
+                st.session_state.basket_version += 1
                 reco.basket.discard(iid)
                 safe_rerun()
             st.markdown("---")
@@ -172,23 +265,25 @@ with st.sidebar:
     matches = st.session_state.get("search_matches", []) or []
     if matches:
         st.markdown(f"**Total matching: {len(matches)}**")
-        for row in matches[:20]:
+        for item_id, description in matches[:20]:
             # highlight the typed substring
             q_cur = st.session_state.get("search_input", "") or ""
-            desc_html = highlight_match(row["description"], q_cur, highlight_bg="#007acc", highlight_fg="#ffffff")
-            id_html = highlight_match(str(row["item_id"]), q_cur, highlight_bg="#5c6cff", highlight_fg="#ffffff")
+            desc_html = highlight_match(description, q_cur, highlight_bg="#007acc", highlight_fg="#ffffff")
+            id_html = highlight_match(str(item_id), q_cur, highlight_bg="#5c6cff", highlight_fg="#ffffff")
             cols = st.columns([7, 2])
             with cols[0]:
                 st.markdown(f"**ID {id_html}** — <span style='{DESCRIPTION_STYLE}'>{desc_html}</span>", unsafe_allow_html=True)
             with cols[1]:
-                if st.button("Add", key=f"search_add_{row['item_id']}"):
-                    st.session_state.basket.add(int(row['item_id']))
-                    reco.basket.add(int(row['item_id']))
+                if st.button("Add", key=f"search_add_{item_id}"):
+                    st.session_state.basket = st.session_state.basket | {int(item_id)}
+                    st.session_state.basket_version += 1
+                    reco.basket.add(int(item_id))
                     safe_rerun()
 
     st.markdown("---")
     if st.button("Reset basket"):
-        st.session_state.basket = set()
+        st.session_state.basket = frozenset()
+        st.session_state.basket_version += 1
         reco.reset_basket()
         safe_rerun()
 
@@ -199,13 +294,20 @@ with st.sidebar:
 # ---------------------------
 # Main area: recommendations
 # ---------------------------
+@st.cache_data(ttl=300, max_entries=256)
+def _recommend(_reco: HybridRecommender, region: str, basket: frozenset, top_n: int):
+    """reco.recommend() memoized on what it depends on; _reco.basket must already match basket."""
+    return _reco.recommend(top_n=top_n)
+
+
 st.subheader("Recommendations")
 
-if st.session_state.basket != reco.basket:
+if st.session_state.synced_basket_version != st.session_state.basket_version:
     reco.basket = set(st.session_state.basket)
+    st.session_state.synced_basket_version = st.session_state.basket_version
 
 try:
-    results = reco.recommend(top_n=top_n)
+    results = _recommend(reco, reco.region, st.session_state.basket, top_n)
 except Exception as e:
     st.error("Error fetching recommendations: " + str(e))
     st.stop()
@@ -213,40 +315,23 @@ except Exception as e:
 if not results:
     st.info("No recommendations yet. Try adding items or adjust Top N.")
 else:
+    card_html = []
     for r in results:
         score = r.get("final_score") or r.get("region_score") or r.get("global_score") or 0.0
         src = r.get("source", "popularity")
-        if src == "region":
-            reason = "Popular in selected region"
-        elif src == "global":
-            reason = "Popular globally"
-        elif src == "rules":
-            reason = "Association-rule based: users who bought items in your basket also bought this"
-        else:
-            reason = "Popularity-based"
-
-        st.markdown(
-            f"""
-            <div style="{CARD_STYLE}">
-              <div style="display:flex; justify-content:space-between; align-items:center;">
-                <div style="flex:1; padding-right:12px;">
-                  <h4 style="margin:0 0 6px 0; color:#ffffff;">{r['description']}</h4>
-                  <div style="color:#d0d7e0; margin-bottom:6px;">Item ID: <b style="color:#ffffff;">{r['item_id']}</b> — <i>{reason}</i></div>
-                  <div style="{DESCRIPTION_STYLE}">Source: <b>{src}</b></div>
-                </div>
-                <div style="text-align:right; min-width:140px;">
-                  <div style="color:#a7e3ff; font-weight:700; font-size:16px;">Score: {score:.3f}</div>
-                </div>
-              </div>
-            </div>
-            """,
-            unsafe_allow_html=True,
-        )
-
-        if st.button(f"➕ Add item {r['item_id']}", key=f"rec_add_{r['item_id']}"):
-            st.session_state.basket.add(int(r['item_id']))
-            reco.basket.add(int(r['item_id']))
-            safe_rerun()
+        reason = REASON.get(src, REASON["popularity"])
+        card_html.append(CARD_TMPL.format(desc=r['description'], iid=r['item_id'], reason=reason, src=src, score=score))
+
+    # one markdown element for all cards, then the Add buttons as a compact grid
+    st.markdown("".join(card_html), unsafe_allow_html=True)
+    add_cols = st.columns(5)
+    for i, r in enumerate(results):
+        with add_cols[i % 5]:
+            if st.button(f"➕ Add item {r['item_id']}", key=f"rec_add_{r['item_id']}"):
+                st.session_state.basket = st.session_state.basket | {int(r['item_id'])}
+                st.session_state.basket_version += 1
+                reco.basket.add(int(r['item_id']))
+                safe_rerun()
 
 st.markdown("---")
 st.caption("Hint: search results update as you type.")